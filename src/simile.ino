@@ -21,6 +21,11 @@ int currentFrame = 0;
 int currentAnimationIndex = 0;
 
 void setup() {
+    // Animations arrive in a single burst while earlier lines are still being
+    // parsed and echoed back. A full upload is 10 animations of 50 frames at
+    // up to ~37 characters each (~18.5KB), so this leaves ~2KB for the CLEAR,
+    // PLAY_ALL and ANIM headers. Very long animation names can still overflow it.
+    Serial.setRxBufferSize(20480);
     Serial.begin(115200);
     lmd.setEnabled(true);
     lmd.setIntensity(1);
@@ -65,8 +70,16 @@ void checkSerial() {
     }
 }
 
+int hexValue(char c) {
+    if (c >= '0' && c <= '9') return c - '0';
+    if (c >= 'a' && c <= 'f') return c - 'a' + 10;
+    if (c >= 'A' && c <= 'F') return c - 'A' + 10;
+    return -1;
+}
+
 void parseAnimationData(String data) {
     // Format: "AnimName|frame1:duration1 frame2:duration2 ..."
+    // Each frame is 16 hex characters, two per row of the matrix.
     int pipeIndex = data.indexOf('|');
     if (pipeIndex == -1) {
         Serial.println("Error: No pipe found in animation data");
@@ -108,39 +121,30 @@ void parseAnimationData(String data) {
             idx++;
         }
         
-        if (idx + 64 >= frameData.length()) break;
+        if (idx + 16 >= frameData.length()) break;
         
         byte frame[8] = {0};
         bool validFrame = true;
         
         for (int i = 0; i < 8; i++) {
-            byte b = 0;
-            for (int j = 0; j < 8; j++) {
-                if (idx + i * 8 + j >= frameData.length()) {
-                    validFrame = false;
-                    break;
-                }
-                char c = frameData.charAt(idx + i * 8 + j);
-                b <<= 1;
-                if (c == '1') b |= 1;
-                else if (c != '0') {
-                    Serial.println("Invalid character in frame data: " + String(c));
-                    validFrame = false;
-                    break;
-                }
+            int high = hexValue(frameData.charAt(idx + i * 2));
+            int low = hexValue(frameData.charAt(idx + i * 2 + 1));
+            if (high == -1 || low == -1) {
+                Serial.println("Invalid character in frame data: " + frameData.substring(idx + i * 2, idx + i * 2 + 2));
+                validFrame = false;
+                break;
             }
-            if (!validFrame) break;
-            frame[i] = b;
+            frame[i] = (high << 4) | low;
         }
         
         if (!validFrame) break;
         
-        if (idx + 64 >= frameData.length() || frameData.charAt(idx + 64) != ':') {
+        if (frameData.charAt(idx + 16) != ':') {
             Serial.println("Error: Missing colon after frame data");
             break;
         }
         
-        int durStart = idx + 65;
+        int durStart = idx + 17;
         int durEnd = frameData.indexOf(' ', durStart);
         if (durEnd == -1) durEnd = frameData.length();
         
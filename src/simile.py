@@ -1,72 +1,138 @@
+import io
 import json
 import subprocess
 import sys
 import time
 
+import pandas as pd
 import serial
 import serial.tools.list_ports
 import streamlit as st
 from PIL import Image
 
+# Maps any non-zero red value to a set pixel when thresholding a sprite.
+_RED_THRESHOLD = [0] + [255] * 255
+
+# Port descriptions that identify the USB to serial chip on the ESP32.
+_PORT_KEYWORDS = ("usb serial", "cp210", "ch340", "silicon labs")
+
+# The most animations, and frames in each, that the board has room for.
+_MAX_ANIMATIONS = 10
+_MAX_FRAMES = 50
+
+# Size in pixels that each frame is upscaled to when previewed.
+_TILE_SIZE = 64
+
 
 def find_esp32_port():
-    ports = serial.tools.list_ports.comports()
-    for p in ports:
-        desc = p.description.lower()
-        if any(x in desc for x in ["usb serial", "cp210", "ch340", "silicon labs"]):
-            return p.device
-    return None
+    return next(
+        (
+            p.device
+            for p in serial.tools.list_ports.comports()
+            if any(k in p.description.lower() for k in _PORT_KEYWORDS)
+        ),
+        None,
+    )
 
 
-def image_to_byte_array(file) -> list[int]:
+def image_to_byte_array(image: Image) -> list[int]:
     """Convert an image to a binary byte array.
 
     This method only works with images that only has shades of red and
     nothing else. It returns a byte array with a set bit indicating that
     that pixel was red."""
-    img = Image.open(file).convert("RGB").resize((8, 8))
-    data = []
-    for y in range(8):
-        byte = 0
-        for x in range(8):
-            r, _, _ = img.getpixel((x, y))
-            if r != 0:
-                byte |= 1 << (7 - x)
-        data.append(byte)
-    return data
-
-
-def resized_image(file, scale: int = 32) -> Image:
-    """Resize an 8x8 image so that it doesn't appear blurry."""
-    image = Image.open(file).convert("RGB")
-    return image.resize((image.width * scale, image.height * scale), Image.NEAREST)
+    # Only the red channel matters, so drop the others before resizing.
+    red = image.getchannel("R")
+    if red.size != (8, 8):
+        # BOX averages each block, so a pixel is only set if the block's mean
+        # red rounds above zero; sparse red in a large source can be lost.
+        red = red.resize((8, 8), Image.Resampling.BOX)
+    # A 1-bit image packs each row into a byte with the leftmost pixel as the MSB.
+    bits = red.point(_RED_THRESHOLD, mode="1")
+    return list(bits.tobytes())
+
+
+@st.cache_data(show_spinner=False)
+def load_sprite(file_bytes: bytes) -> tuple[list[int], Image]:
+    """Decode an uploaded sprite into its byte array and preview tile.
+
+    Both are produced from a single decode so that each upload is only
+    opened once. The tile is upscaled without smoothing so that it doesn't
+    appear blurry."""
+    image = Image.open(io.BytesIO(file_bytes)).convert("RGB")
+    tile = image.resize((_TILE_SIZE, _TILE_SIZE), Image.Resampling.NEAREST)
+    return image_to_byte_array(image), tile
+
+
+@st.cache_data(show_spinner=False)
+def sprite_mosaic(
+    files: tuple[bytes, ...], frames_per_row: int = 8, gap: int = 4
+) -> Image:
+    """Arrange the frames of an animation into one image for previewing.
+
+    Frames are laid out left to right in rows using the tiles from
+    `load_sprite`."""
+    cols = min(len(files), frames_per_row)
+    rows = -(-len(files) // frames_per_row)
+    step = _TILE_SIZE + gap
+    mosaic = Image.new("RGB", (cols * step - gap, rows * step - gap), "white")
+    for i, file_bytes in enumerate(files):
+        _, tile = load_sprite(file_bytes)
+        row, col = divmod(i, frames_per_row)
+        mosaic.paste(tile, (col * step, row * step))
+    return mosaic
 
 
 def create_animation(name: str) -> None:
     if name and name not in st.session_state.animations:
-        st.session_state.animations[name] = {"duration": [], "sprites": []}
+        st.session_state.animations[name] = {
+            "duration": [],
+            "sprites": [],
+            "sprite_hex": [],
+        }
 
 
 def remove_animation(name: str) -> None:
     if name in st.session_state.animations:
-        st.session_state.animations.pop(name)
+        popped = st.session_state.animations.pop(name)
+        st.session_state.total_frames -= len(popped["sprites"])
+        st.session_state.pop(f"sprite_sig_{name}", None)
+
+
+def candidate_ports():
+    """Yield the ports the board may be on, starting with the last known one.
+
+    Ports are only enumerated if the last known port couldn't be used, and
+    the last known port isn't tried again if it is the one that was found."""
+    cached_port = st.session_state._cached_port
+    if cached_port:
+        yield cached_port
+    port = find_esp32_port()
+    if port != cached_port:
+        yield port
 
 
 def get_serial_connection():
     """Get or create a persistent serial connection"""
     if st.session_state.serial_connection is None:
-        port = find_esp32_port()
-        if port:
+        error = None
+        for port in candidate_ports():
+            if not port:
+                continue
             try:
                 st.session_state.serial_connection = serial.Serial(
                     port, 115200, timeout=1
                 )
+                st.session_state._cached_port = port
 
                 time.sleep(2)
                 return st.session_state.serial_connection
             except Exception as e:
-                st.error(f"Error connecting to board: {e}")
-                return None
+                error = e
+
+        st.session_state._cached_port = None
+        if error:
+            st.error(f"Error connecting to board: {error}")
     return st.session_state.serial_connection
 
 
@@ -77,21 +143,28 @@ def close_serial_connection():
         st.session_state.serial_connection = None
 
 
-def send_to_board(data: str) -> bool:
-    """Send data to the ESP32 board using persistent connection"""
+def send_to_board(data: str | bytes, wait_response: bool = False) -> bool:
+    """Send data to the ESP32 board using persistent connection
+
+    The board's response is only waited for and printed if `wait_response`
+    is set, otherwise this returns as soon as the data has been written."""
     ser = get_serial_connection()
     if ser:
         try:
-            print(f"Sending to board: {data.strip()}")
-            ser.write(data.encode())
+            if isinstance(data, str):
+                data = data.encode()
+            print(f"Sending to board: {data.decode().strip()}")
+            if wait_response:
+                # Drop earlier output so only the response to this is read.
+                ser.reset_input_buffer()
+            ser.write(data)
             ser.flush()
 
-            import time
-
-            time.sleep(0.1)
-            if ser.in_waiting:
-                response = ser.read(ser.in_waiting).decode("utf-8", errors="ignore")
-                print(f"Board response: {response}")
+            if wait_response:
+                time.sleep(0.1)
+                if ser.in_waiting:
+                    response = ser.read(ser.in_waiting).decode("utf-8", errors="ignore")
+                    print(f"Board response: {response}")
 
             return True
         except Exception as e:
@@ -109,31 +182,54 @@ def upload_animations() -> None:
         st.toast("No animations to upload!")
         return
 
-    send_to_board("CLEAR\n")
-
-    for anim_name, data in st.session_state.animations.items():
-        if not data["sprites"]:
-            continue
+    # Everything is sent in a single write so that the board receives all the
+    # animations at once instead of waiting on each message in turn.
+    payload = bytearray()
+    payload += b"CLEAR\n"
+
+    # Anything past the board's limits would overflow its serial buffer and
+    # corrupt the lines after it, so it is left out of the upload.
+    animations = [
+        (anim_name, data)
+        for anim_name, data in st.session_state.animations.items()
+        if data["sprites"]
+    ]
+    if len(animations) > _MAX_ANIMATIONS or any(
+        len(data["sprites"]) > _MAX_FRAMES for _, data in animations
+    ):
+        st.warning(
+            f"The board only holds {_MAX_ANIMATIONS} animations of up to"
+            f" {_MAX_FRAMES} frames each, the rest won't be uploaded."
+        )
 
-        frame_data = ""
-        for sprite, duration in zip(data["sprites"], data["duration"]):
-            binary_string = "".join(f"{byte:08b}" for byte in sprite)
-            frame_data += f"{binary_string}:{duration} "
+    for anim_name, data in animations[:_MAX_ANIMATIONS]:
+        frame_data = " ".join(
+            f"{sprite_hex}:{duration}"
+            for sprite_hex, duration in zip(
+                data["sprite_hex"][:_MAX_FRAMES], data["duration"]
+            )
+        )
+        payload += f"ANIM:{anim_name}|{frame_data}\n".encode()
 
-        frame_data = frame_data.strip()
-        animation_line = f"ANIM:{anim_name}|{frame_data}\n"
+    payload += b"PLAY_ALL\n"
 
-        if not send_to_board(animation_line):
-            return
+    if not send_to_board(bytes(payload), wait_response=False):
+        return
 
     save_animations_to_disk()
-    send_to_board("PLAY_ALL\n")
     st.success("Animations uploaded successfully!")
 
 
 def save_animations_to_disk() -> None:
     with open("animations.json", "w") as f:
-        json.dump(st.session_state.animations, f)
+        # The hex frames are rebuilt from the sprites when loading.
+        json.dump(
+            {
+                name: {k: v for k, v in data.items() if k != "sprite_hex"}
+                for name, data in st.session_state.animations.items()
+            },
+            f,
+        )
 
 
 def play_specific_animation(name: str) -> None:
@@ -148,19 +244,120 @@ def clear_board() -> None:
         st.success("Board cleared!")
 
 
+@st.fragment
+def render_animation(anim_name: str, data: dict) -> None:
+    """Render the controls and frames of a single animation.
+
+    This runs as a fragment so that changing one of its widgets only reruns
+    this animation rather than the whole app."""
+    with st.container(border=True):
+        header_col1, header_col2, header_col3 = st.columns([0.6, 0.2, 0.2])
+        with header_col1:
+            st.subheader(f"🎬 {anim_name}")
+        with header_col2:
+            if st.button(
+                "Play Animation",
+                key=f"play_{anim_name}",
+                disabled=not data["sprites"],
+            ):
+                play_specific_animation(anim_name)
+        with header_col3:
+            # Removing an animation changes the whole page, not just this fragment.
+            if st.button(
+                "Remove Animation",
+                key=f"remove_{anim_name}",
+                type="secondary",
+            ):
+                remove_animation(anim_name)
+                st.rerun()
+
+        sprites = st.file_uploader(
+            f"Upload frames for {anim_name}:",
+            ["jpg", "jpeg", "png"],
+            key=f"uploader_{anim_name}",
+            accept_multiple_files=True,
+            help="Upload 8x8 images with red pixels for the LED matrix",
+        )
+
+        if sprites:
+            # Only decode the frames again when the uploaded files change.
+            sprite_sig = tuple(sprite.file_id for sprite in sprites)
+            if st.session_state.get(f"sprite_sig_{anim_name}") != sprite_sig:
+                st.session_state[f"sprite_sig_{anim_name}"] = sprite_sig
+                old_frames = len(data["sprites"])
+                data["sprites"] = []
+                data["sprite_hex"] = []
+
+                for sprite in sprites:
+                    byte_array, _ = load_sprite(sprite.getvalue())
+                    data["sprites"].append(byte_array)
+                    data["sprite_hex"].append(bytes(byte_array).hex())
+
+                st.session_state.total_frames += len(data["sprites"]) - old_frames
+                # Durations edited for the previous files don't apply to these.
+                st.session_state.pop(f"durations_{anim_name}", None)
+                # Rerun the app so that the totals below reflect the new frames.
+                st.rerun()
+
+        if sprites:
+            st.write(f"**Frames ({len(sprites)} total):**")
+
+            st.image(
+                sprite_mosaic(tuple(sprite.getvalue() for sprite in sprites)),
+                output_format="PNG",
+            )
+
+            durations = st.data_editor(
+                pd.DataFrame(
+                    {
+                        "frame": [sprite.name for sprite in sprites],
+                        "duration": [1.0 / len(sprites)] * len(sprites),
+                    }
+                ),
+                key=f"durations_{anim_name}",
+                hide_index=True,
+                disabled=["frame"],
+                column_config={
+                    "frame": st.column_config.TextColumn("Frame"),
+                    "duration": st.column_config.NumberColumn(
+                        "Duration (s)",
+                        min_value=0.1,
+                        max_value=10.0,
+                        step=0.001,
+                        format="%.1f",
+                        required=True,
+                    ),
+                },
+            )
+            data["duration"] = durations["duration"].tolist()
+
+        elif data["sprites"]:
+            st.info(f"Animation has {len(data['sprites'])} frames ready to upload.")
+
+
 if "serial_connection" not in st.session_state:
     st.session_state.serial_connection = None
 
+if "_cached_port" not in st.session_state:
+    st.session_state._cached_port = None
+
 
 if "animations" not in st.session_state:
     try:
         with open("animations.json", "r") as f:
             st.session_state.animations = json.load(f)
+        for data in st.session_state.animations.values():
+            data["sprite_hex"] = [bytes(s).hex() for s in data["sprites"]]
         get_serial_connection()
         upload_animations()
     except FileNotFoundError:
         st.session_state.animations = {}
 
+if "total_frames" not in st.session_state:
+    st.session_state.total_frames = sum(
+        len(anim["sprites"]) for anim in st.session_state.animations.values()
+    )
+
 
 st.title("Matrix Animator")
 st.write(
@@ -211,90 +408,20 @@ with st.container(border=True):
             clear_board()
     with button_col4:
         if st.button("**Debug Board Info**"):
-            send_to_board("DEBUG\n")
+            send_to_board("DEBUG\n", wait_response=True)
     with button_col5:
         if st.button("**Upload Test Pattern**"):
-            test_pattern = "11111111" * 8
+            test_pattern = "ff" * 8
             send_to_board(f"ANIM:TEST|{test_pattern}:1.0\n")
             send_to_board("PLAY:TEST\n")
 
-for i, (anim_name, data) in enumerate(st.session_state.animations.items()):
-    with st.container(border=True):
-        header_col1, header_col2, header_col3 = st.columns([0.6, 0.2, 0.2])
-        with header_col1:
-            st.subheader(f"🎬 {anim_name}")
-        with header_col2:
-            st.button(
-                "Play Animation",
-                key=f"play_{anim_name}",
-                on_click=play_specific_animation,
-                args=[anim_name],
-                disabled=not data["sprites"],
-            )
-        with header_col3:
-            st.button(
-                "Remove Animation",
-                key=f"remove_{anim_name}",
-                on_click=remove_animation,
-                args=[anim_name],
-                type="secondary",
-            )
-
-        sprites = st.file_uploader(
-            f"Upload frames for {anim_name}:",
-            ["jpg", "jpeg", "png"],
-            key=f"uploader_{anim_name}",
-            accept_multiple_files=True,
-            help="Upload 8x8 images with red pixels for the LED matrix",
-        )
-
-        if sprites:
-            data["sprites"] = []
-            data["duration"] = []
-
-            for sprite in sprites:
-                byte_array = image_to_byte_array(sprite)
-                data["sprites"].append(byte_array)
-
-        if sprites:
-            st.write(f"**Frames ({len(sprites)} total):**")
-
-            frames_per_row = 8
-            for row_start in range(0, len(sprites), frames_per_row):
-                row_sprites = sprites[row_start : row_start + frames_per_row]
-                cols = st.columns(len(row_sprites))
-
-                for col, sprite in zip(cols, row_sprites):
-                    with col:
-                        st.image(
-                            resized_image(sprite),
-                            width=64,
-                            output_format="PNG",
-                            channels="RGB",
-                            clamp=True,
-                            caption=sprite.name,
-                        )
-
-                        duration = st.number_input(
-                            "Duration (s)",
-                            value=1.0 / len(sprites),
-                            key=f"duration_{anim_name}_{sprite.name}",
-                            min_value=0.1,
-                            max_value=10.0,
-                            step=0.001,
-                            format="%.1f",
-                        )
-                        data["duration"].append(duration)
-
-        elif data["sprites"]:
-            st.info(f"Animation has {len(data['sprites'])} frames ready to upload.")
+for anim_name, data in st.session_state.animations.items():
+    render_animation(anim_name, data)
 
 if st.session_state.animations:
-    total_frames = sum(
-        len(anim["sprites"]) for anim in st.session_state.animations.values()
-    )
     st.info(
-        f"Total: {len(st.session_state.animations)} animations, {total_frames} frames"
+        f"Total: {len(st.session_state.animations)} animations,"
+        f" {st.session_state.total_frames} frames"
     )
 else:
     st.info("💡 Create your first animation to get started!")